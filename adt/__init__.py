@@ -4,8 +4,20 @@
 __version__ = "0.2.11"
 __author__ = 'Hannes Saffrich'
 
-from dataclasses import dataclass
-import inspect
+from dataclasses import make_dataclass
+from functools import lru_cache
+import sys
+
+def _positional_params(con_ty) -> dict:
+    return { f"_{i+1}": t for (i, t) in enumerate(con_ty) }
+
+# Maps the type of a constructor annotation to a function building its parameters.
+_PARAM_BUILDERS = {
+    dict:  lambda con_ty: con_ty,
+    tuple: _positional_params,
+    list:  _positional_params,
+    type:  lambda con_ty: { "_1": con_ty },
+}
 
 def adt(Class=None, export=False, **kwargs):
     """Class-decorator for Algebraic Data Types (ADTs).
@@ -19,7 +31,7 @@ def adt(Class=None, export=False, **kwargs):
     Arguments:
         export:
             if `False`, only define the constructor classes as fields of the decorated class;
-            if `True`, also define the constructor classes in the global namespace.
+            if `True`, also define the constructor classes in the globals of the module declaring the ADT.
         **kwargs: 
             additional passed keyword arguments passed to dataclass decorator. 
 
@@ -62,85 +74,128 @@ def adt(Class=None, export=False, **kwargs):
         ... 
         >>> var = Expr.Var("x")
         >>> var._0 = "y" # error!
+        Traceback (most recent call last):
+        ...
+        dataclasses.FrozenInstanceError: cannot assign to field '_0'
+
+        Keyword-only fields are not matched positionally:
+
+        >>> @adt(kw_only=True)
+        ... class Point:
+        ...     P2: {'x': int, 'y': int}
+        >>> Point.P2.__match_args__
+        ()
+
+        A class without constructor annotations is rejected:
+
+        >>> @adt
+        ... class Empty:
+        ...     pass
+        Traceback (most recent call last):
+        ...
+        TypeError: ADT Empty does not declare any constructors
     """
     decorator = adt_with(export, **kwargs)
     return decorator if Class is None else decorator(Class)
 
-def adt_with(export_cons: bool, **kwargs):
+def adt_with(export: bool, **kwargs):
     def decorator(Base):
-        annotations = vars(Base)["__annotations__"]
-        Base.__annotations__ = dict()
+        annotations = Base.__dict__.get("__annotations__")
+        if not annotations:
+            raise TypeError(f"ADT {Base.__name__} does not declare any constructors")
 
         def Base_init(self, *args, **kwargs):
             raise TypeError(f"Tryed to construct an ADT instead of one of it's constructor.")
-        Base.__init__ = Base_init
-        Base.constructors = dict()
+        constructors = dict()
+        # Collected first and installed in a single pass after all
+        # constructors are built, so an invalid constructor definition
+        # leaves `Base` untouched.
+        members = { "__init__": Base_init, "constructors": constructors }
 
         for con_name, con_ty in annotations.items():
-            if type(con_ty) == dict:
-                params = con_ty
-            elif type(con_ty) == tuple or type(con_ty) == list:
-                params = { f"_{i+1}": t for (i, t) in enumerate(con_ty) }
-            elif type(con_ty) == type:
-                params = { "_1": con_ty }
-            else:
+            build_params = _PARAM_BUILDERS.get(type(con_ty))
+            if build_params is None:
                 raise TypeError(f"ADT with invalid constructor definition {con_name}: {con_ty}")
+            params = build_params(con_ty)
 
-            Con = dataclass(type(con_name, (Base, ), { "__annotations__": params }), **kwargs)
-            setattr(Base, con_name, Con)
-            Base.constructors[con_name] = Con
+            Con = _make_con(con_name, params, Base, kwargs)
+            members[con_name] = Con
+            constructors[con_name] = Con
 
-            def is_con_gen(Con):
-                def is_con(self) -> bool:
-                    return isinstance(self, Con)
-                return is_con
             is_con_name = "is_" + upper_camel_to_snake(con_name)
-            setattr(Base, is_con_name, is_con_gen(Con))
-
-        def export_cons_fn():
-            frame = inspect.currentframe()
-            if frame is None:
-                raise RuntimeError('Cannot inspect stack frames')
-            frame = frame.f_back
-            while frame is not None:
-                for con_name in annotations:
-                    frame.f_globals[con_name] = getattr(Base, con_name)
-                frame = frame.f_back
-        setattr(Base, "export_cons", export_cons_fn)
-
-        if export_cons:
+            # Binding `Con` and `isinstance` as keyword-only default arguments
+            # makes them fast local lookups instead of closure cell and global
+            # lookups, while stray positional arguments still raise.
+            def is_con(self, *, _Con=Con, _isinstance=isinstance) -> bool:
+                return _isinstance(self, _Con)
+            is_con.__name__ = is_con_name
+            is_con.__qualname__ = f"{Base.__qualname__}.{is_con_name}"
+            members[is_con_name] = is_con
+
+        # The constructor definitions are not fields of `Base` and would
+        # otherwise show up in the type hints of all constructors.
+        del Base.__annotations__
+        for name, value in members.items():
+            setattr(Base, name, value)
+
+        if export:
+            def export_cons_fn():
+                export_cons(Base)
+            setattr(Base, "export_cons", export_cons_fn)
             export_cons_fn()
 
-
-        # def import_cons():
-        #     frame = inspect.currentframe()
-        #     if frame is None:
-        #         raise RuntimeError('Cannot inspect stack frames')
-        #     frame = frame.f_back
-        #     if frame is None:
-        #         raise RuntimeError('Cannot inspect stack frames')
-        #     # if '__name__' in frame.f_locals:
-        #     #     print("GLOBAL")
-        #     #     scope = frame.f_locals
-        #     # else:
-        #     #     scope = frame.f_globals
-        #     scope = frame.f_builtins
-        #     # scope = frame.f_globals
-        #     for con_name in annotations:
-        #         scope[con_name] = getattr(Base, con_name)
-
-        # setattr(Base, "import_cons", import_cons)
-
         return Base
     return decorator
 
+def export_cons(Base: type):
+    """Defines the constructor classes of an ADT in the global namespace of the caller.
+
+    This is what `@adt(export=True)` does at decoration time and allows to
+    export the constructors of an ADT decorated with plain `@adt` later on.
+
+    Examples:
+        >>> @adt
+        ... class Expr:
+        ...     Var: str
+        ...     App: ['Expr', 'Expr']
+        >>> export_cons(Expr)
+        >>> App(Var("f"), Var("x")).is_app()
+        True
+    """
+    g = _caller_globals()
+    for con_name, Con in Base.constructors.items():
+        g[con_name] = Con
+
+def _caller_globals() -> dict:
+    # The globals of the nearest caller outside of this module, i.e. the
+    # module which declares or exports the ADT.
+    frame = sys._getframe(2)
+    while frame.f_globals is globals():
+        frame = frame.f_back
+    return frame.f_globals
+
+def _make_con(con_name: str, params: dict, Base: type, kwargs: dict) -> type:
+    # `make_dataclass` already generates a straight-line `__init__`
+    # specialized to the fields via `exec`, so we only prepare the class
+    # body for it.
+    namespace = { "__module__": __name__ }
+    # `dataclass` excludes keyword-only fields from `__match_args__`, so
+    # we only pre-set it if all fields are positional.
+    if kwargs.get("match_args", True) and not kwargs.get("kw_only", False):
+        namespace["__match_args__"] = tuple(params)
+    return make_dataclass(con_name, params.items(), bases=(Base, ), namespace=namespace, **kwargs)
+
+@lru_cache(maxsize=None)
 def upper_camel_to_snake(s: str) -> str:
-    out = ""
-    for i, c in enumerate(s):
-        if c.isupper():
-            if i != 0:
-                out += "_"
-            out += c.lower()
-        else:
-            out += c
-    return out
+    """Converts an `UpperCamelCase` name to `snake_case`.
+
+    Examples:
+        >>> upper_camel_to_snake("HTTPReq")
+        'h_t_t_p_req'
+        >>> upper_camel_to_snake("FooÄbc")
+        'foo_äbc'
+    """
+    return "".join(
+        ("_" + c.lower() if i != 0 else c.lower()) if c.isupper() else c
+        for i, c in enumerate(s)
+    )
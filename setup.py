@@ -4,9 +4,9 @@ with open('docs/overview.md', 'r') as f:
     desc = f.read()
     skip_start = "[//]: # (INSTALL_BEGIN)"
     skip_end = "[//]: # (INSTALL_END)"
-    begin = desc.find(skip_start)
-    end = desc.find(skip_end) + len(skip_end)
-    desc = desc[:begin] + desc[end:]
+    before, _, rest = desc.partition(skip_start)
+    _, _, after = rest.partition(skip_end)
+    desc = before + after
 
 setup(
     name='adt-decorators',